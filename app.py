@@ -1,20 +1,74 @@
 from flask import Flask, render_template, request
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
 from azure.storage.blob import BlobServiceClient
-from datetime import datetime
+from datetime import datetime, timezone
 import pyodbc
 import uuid
 from urllib.parse import urlparse
-from azure.core.exceptions import ResourceExistsError
+from azure.core.exceptions import ResourceExistsError, HttpResponseError
+from azure.core import MatchConditions
+from azure.core.pipeline.transport import RequestsTransport
 from azure.communication.email import EmailClient
+from azure.data.tables import TableServiceClient
 import mimetypes
-from azure.storage.blob import ContentSettings
+from azure.storage.blob import ContentSettings, BlobType
+import queue
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import ahocorasick
+import threading
+import atexit
+from collections import OrderedDict
 
 
 
 app = Flask(__name__)
 
+# Background workers for the storage / SQL / email side effects of a prediction,
+# so the response does not wait on them
+executor = ThreadPoolExecutor(max_workers=16)
+
+
+# Per image URL caches so resubmitting the same image skips Computer Vision and
+# the blob upload. Only small results are kept, never the image bytes. Entries
+# expire after CACHE_TTL seconds in case the image behind a URL changes.
+CACHE_SIZE = 1024
+CACHE_TTL = 3600  # seconds
+_prediction_cache = OrderedDict()  # image URL -> (stored_at, (sport, score, all_scores))
+_blob_url_cache = OrderedDict()  # image URL -> (stored_at, blob URL)
+_cache_lock = threading.Lock()
+
+
+def _cache_get(cache, key):
+    with _cache_lock:
+        if key not in cache:
+            return None
+        stored_at, value = cache[key]
+        if time.monotonic() - stored_at > CACHE_TTL:
+            del cache[key]
+            return None
+        cache.move_to_end(key)
+        return value
+
+
+def _cache_put(cache, key, value):
+    with _cache_lock:
+        cache[key] = (time.monotonic(), value)
+        cache.move_to_end(key)
+        if len(cache) > CACHE_SIZE:
+            cache.popitem(last=False)
+
+
+def _report_background_error(future):
+    """Done-callback that prints any exception raised by a background task."""
+    exc = future.exception()
+    if exc is not None:
+        print(f"Error in background task: {exc}")
+
 # ---- Computer Vision config ----
 # In Azure App Service → Configuration:
 #   CV_KEY = <your key>
@@ -23,31 +77,210 @@ SUBSCRIPTION_KEY = os.environ.get("CV_KEY")
 ENDPOINT = os.environ.get("CV_ENDPOINT")
 
 SQL_CONNECTION_STRING = os.environ.get("SQL_CONNECTION_STRING")
+# Pool size is per gunicorn worker: keep SQL_POOL_SIZE * workers under the
+# database's connection limit.
+SQL_POOL_SIZE = int(os.environ.get("SQL_POOL_SIZE", "16"))
+# Pooled connections older than this are closed and reopened (seconds)
+SQL_POOL_RECYCLE = int(os.environ.get("SQL_POOL_RECYCLE", "1800"))
+
+# Let the ODBC driver manager reuse handles too (must be set before the first connect)
+pyodbc.pooling = True
+
+# Process-wide pool of (connection, opened_at), filled lazily and reused across requests
+_sql_pool = queue.Queue(maxsize=SQL_POOL_SIZE)
+
+
+def _open_sql_connection():
+    """Open a new SQL connection for the pool; commits are explicit per batch."""
+    # pyodbc's Python 3 defaults already bind str as UTF-16LE (SQL Server's
+    # nvarchar encoding) and decode varchar as UTF-8, so no encoding setup.
+    return pyodbc.connect(SQL_CONNECTION_STRING, autocommit=False)
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
 
-def save_prediction_to_db(image_url, email, sport, score, blob_url):
-    """Insert one prediction row into Azure SQL Database, including blob URL."""
-    if not SQL_CONNECTION_STRING:
-        print("No SQL connection string configured, skipping DB save.")
-        return
 
+def _is_connection_alive(conn):
+    """Cheap round-trip to catch connections the server closed while idle."""
     try:
-        conn = pyodbc.connect(SQL_CONNECTION_STRING)
         cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO Predictions (ImageUrl, Email, Sport, Score, BlobUrl)
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            (image_url, email, sport, float(score), blob_url)  
-        )
-        conn.commit()
+        cursor.execute("SELECT 1").fetchone()
         cursor.close()
+        return True
+    except Exception:
+        return False
+
+
+def _checkout_sql_connection():
+    """Take a live pooled connection, or open a new one if none is usable."""
+    while True:
+        try:
+            conn, opened_at = _sql_pool.get_nowait()
+        except queue.Empty:
+            return _open_sql_connection(), time.monotonic()
+
+        if time.monotonic() - opened_at > SQL_POOL_RECYCLE or not _is_connection_alive(conn):
+            _close_quietly(conn)
+            continue
+        return conn, opened_at
+
+
+@contextmanager
+def get_sql_connection(fresh=False):
+    """Borrow a connection from the pool and give it back when done.
+
+    Pooled connections are pinged before use and recycled after
+    SQL_POOL_RECYCLE seconds; `fresh=True` skips the pool and opens a new
+    one. A connection that raised while in use is closed instead of
+    returned, so a broken link never gets handed to the next request.
+    """
+    if fresh:
+        conn, opened_at = _open_sql_connection(), time.monotonic()
+    else:
+        conn, opened_at = _checkout_sql_connection()
+
+    try:
+        yield conn
+    except BaseException:
+        # Includes GeneratorExit from a generator closed while holding the connection
+        _close_quietly(conn)
+        raise
+
+    try:
+        _sql_pool.put_nowait((conn, opened_at))
+    except queue.Full:
         conn.close()
-        print("✅ Saved prediction to SQL DB with BlobUrl.")
+
+
+# Predictions are buffered and written in batches by one background thread
+SQL_BATCH_SIZE = 200
+SQL_FLUSH_INTERVAL = 0.25  # seconds
+
+INSERT_PREDICTION_SQL = """
+    INSERT INTO Predictions (ImageUrl, Email, Sport, Score, BlobUrl)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+_pending_rows = queue.Queue()
+_sql_writer_thread = None
+_sql_writer_lock = threading.Lock()
+
+# Put on the queue to make the writer flush what it holds and exit
+_STOP_WRITER = object()
+
+
+def _insert_prediction_rows(rows, fresh=False):
+    """Insert a batch of prediction rows in one round-trip."""
+    with get_sql_connection(fresh=fresh) as conn:
+        cursor = conn.cursor()
+        cursor.fast_executemany = True
+        cursor.executemany(INSERT_PREDICTION_SQL, rows)
+        conn.commit()
+        cursor.close()
+
+
+def _insert_rows_one_by_one(rows):
+    """Fallback when a batch is rejected: save every row that is valid on its own."""
+    saved = 0
+    for row in rows:
+        try:
+            _insert_prediction_rows([row])
+            saved += 1
+        except Exception as e:
+            print(f"❌ Error saving prediction for {row[0]} to SQL DB: {e}")
+    return saved
+
+
+def _flush_rows(rows):
+    try:
+        try:
+            _insert_prediction_rows(rows)
+        except (pyodbc.OperationalError, pyodbc.InterfaceError) as e:
+            # The batch was rolled back with the broken connection; retry it once
+            print(f"SQL connection error, retrying {len(rows)} prediction(s): {e}")
+            _insert_prediction_rows(rows, fresh=True)
+        print(f"✅ Saved {len(rows)} prediction(s) to SQL DB with BlobUrl.")
+    except (pyodbc.DataError, pyodbc.IntegrityError) as e:
+        # One bad row (e.g. an email too long for its column) fails the whole
+        # batch; don't let it take the other users' predictions with it
+        print(f"Batch of {len(rows)} prediction(s) rejected, saving rows one by one: {e}")
+        saved = _insert_rows_one_by_one(rows)
+        print(f"✅ Saved {saved} of {len(rows)} prediction(s) to SQL DB with BlobUrl.")
     except Exception as e:
-        print(f"❌ Error saving prediction to SQL DB: {e}")
+        print(f"❌ Error saving {len(rows)} prediction(s) to SQL DB: {e}")
+
+
+def _sql_writer_loop():
+    """Drain the queue, flushing every SQL_BATCH_SIZE rows or SQL_FLUSH_INTERVAL."""
+    while True:
+        item = _pending_rows.get()
+        if item is _STOP_WRITER:
+            return
+
+        rows = [item]
+        stopping = False
+        deadline = time.monotonic() + SQL_FLUSH_INTERVAL
+
+        while len(rows) < SQL_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = _pending_rows.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP_WRITER:
+                stopping = True
+                break
+            rows.append(item)
+
+        _flush_rows(rows)
+        if stopping:
+            return
+
+
+@atexit.register
+def _flush_pending_rows():
+    """Write whatever is still buffered when the worker shuts down."""
+    # Let the writer flush the batch it has already taken off the queue first
+    if _sql_writer_thread is not None and _sql_writer_thread.is_alive():
+        _pending_rows.put(_STOP_WRITER)
+        _sql_writer_thread.join(timeout=30)
+
+    rows = []
+    while True:
+        try:
+            item = _pending_rows.get_nowait()
+        except queue.Empty:
+            break
+        if item is not _STOP_WRITER:
+            rows.append(item)
+    if rows:
+        _flush_rows(rows)
+
 
+def _ensure_sql_writer():
+    # Started lazily so each gunicorn worker gets its own thread after fork
+    global _sql_writer_thread
+
+    with _sql_writer_lock:
+        if _sql_writer_thread is None or not _sql_writer_thread.is_alive():
+            _sql_writer_thread = threading.Thread(target=_sql_writer_loop, name="sql-writer", daemon=True)
+            _sql_writer_thread.start()
+
+
+def save_prediction_to_db(image_url, email, sport, score, blob_url):
+    """Queue one prediction row for Azure SQL Database, including blob URL."""
+    if not SQL_CONNECTION_STRING:
+        print("No SQL connection string configured, skipping DB save.")
+        return
 
+    _ensure_sql_writer()
+    _pending_rows.put((image_url, email, sport, float(score), blob_url))
 
 
 if ENDPOINT:
@@ -56,91 +289,243 @@ if ENDPOINT:
 else:
     ANALYZE_URL = None
 
+# Built once; every analyze call sends the same key and features
+_CV_PARAMS = {"visualFeatures": "Tags,Description,Objects", "language": "en"}
+_CV_HEADERS = {
+    "Ocp-Apim-Subscription-Key": SUBSCRIPTION_KEY,
+    "Content-Type": "application/octet-stream"
+}
+
+# ---- Shared HTTP session ----
+# One keep-alive connection pool for Computer Vision calls and image downloads.
+# Analyze is read-only, so POST is safe to retry on throttling / 5xx.
+HTTP_TIMEOUT = (3.05, 15)  # (connect, read) seconds
+
+session = requests.Session()
+_http_adapter = HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=64,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=frozenset({"GET", "POST"}),
+    ),
+)
+session.mount("https://", _http_adapter)
+session.mount("http://", _http_adapter)
+
 # ---- Blob Storage config ----
 # In Azure App Service → Configuration:
 #   STORAGE_CONNECTION_STRING = <connection string>
 #   STORAGE_CONTAINER_NAME = logs
+#   STORAGE_TABLE_NAME = Predictions   (optional: log to Table Storage instead)
 STORAGE_CONNECTION_STRING = os.environ.get("STORAGE_CONNECTION_STRING")
 STORAGE_CONTAINER_NAME = os.environ.get("STORAGE_CONTAINER_NAME", "logs")
 
 IMAGE_CONTAINER_NAME = os.environ.get("IMAGE_CONTAINER_NAME", "sport-images")
+STORAGE_TABLE_NAME = os.environ.get("STORAGE_TABLE_NAME")
+
+LOG_BLOB_NAME = "predictions.log"
+# Append blobs accept at most 50,000 blocks (one per prediction); after that the
+# log rolls over to predictions-1.log, predictions-2.log, ...
+LOG_BLOB_MAX_BLOCKS = 50000
+_log_blob_index = 0
 
 blob_service_client = None
 blob_container_client = None
+log_blob_client = None
+image_container_client = None
+_containers_initialized = False
 
 if STORAGE_CONNECTION_STRING and STORAGE_CONTAINER_NAME:
     try:
-        blob_service_client = BlobServiceClient.from_connection_string(STORAGE_CONNECTION_STRING)
+        # Give the SDK enough pooled sockets for parallel chunk uploads
+        _blob_http_session = requests.Session()
+        _blob_http_session.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=64))
+        blob_service_client = BlobServiceClient.from_connection_string(
+            STORAGE_CONNECTION_STRING,
+            transport=RequestsTransport(session=_blob_http_session, session_owner=False),
+        )
         blob_container_client = blob_service_client.get_container_client(STORAGE_CONTAINER_NAME)
+        log_blob_client = blob_container_client.get_blob_client(LOG_BLOB_NAME)
+
+        if IMAGE_CONTAINER_NAME:
+            image_container_client = blob_service_client.get_container_client(IMAGE_CONTAINER_NAME)
     except Exception as e:
         print(f"Error initializing Blob Storage client: {e}")
 
+table_client = None
+
+if STORAGE_CONNECTION_STRING and STORAGE_TABLE_NAME:
+    try:
+        table_service_client = TableServiceClient.from_connection_string(STORAGE_CONNECTION_STRING)
+        table_client = table_service_client.create_table_if_not_exists(STORAGE_TABLE_NAME)
+    except Exception as e:
+        print(f"Error initializing Table Storage client: {e}")
+
+
+def _init_log_blob(blob_client):
+    """Make sure `blob_client` is an append blob with room left; return False otherwise.
+
+    IfMissing keeps an existing log instead of truncating it on startup.
+    """
+    try:
+        blob_client.create_append_blob(match_condition=MatchConditions.IfMissing)
+        return True
+    except ResourceExistsError:
+        props = blob_client.get_blob_properties()
+        return (
+            props.blob_type == BlobType.APPENDBLOB
+            and (props.append_blob_committed_block_count or 0) < LOG_BLOB_MAX_BLOCKS
+        )
+
+
+def _next_log_blob():
+    """Return a client for the next numbered log blob that can take appends."""
+    global _log_blob_index
+
+    for _ in range(1000):
+        _log_blob_index += 1
+        blob_client = blob_container_client.get_blob_client(f"predictions-{_log_blob_index}.log")
+        if _init_log_blob(blob_client):
+            return blob_client
+    return None
+
+
+def _roll_over_log_blob(full_client):
+    """Switch to the next log blob once `full_client` can't take appends; returns it."""
+    global log_blob_client
+
+    # Another request may already have rolled over
+    if log_blob_client is full_client:
+        print(f"Rolling the prediction log over from {full_client.blob_name}.")
+        log_blob_client = _next_log_blob()
+        if not log_blob_client:
+            print("❌ No usable prediction log blob found; blob logging disabled.")
+    return log_blob_client
+
+
+# Separate from the client setup so a log failure never disables image uploads
+if log_blob_client:
+    try:
+        # The log is an Append Blob so each prediction only sends its own line.
+        # A log written by older versions is a block blob, which append_block
+        # rejects, so move on to a numbered append log next to it instead.
+        if not _init_log_blob(log_blob_client):
+            print(f"⚠️ {LOG_BLOB_NAME} is full or not an append blob (written by an older version).")
+            _roll_over_log_blob(log_blob_client)
+    except Exception as e:
+        print(f"Error creating prediction log blob: {e}")
+
+
+def ensure_image_container():
+    """Create the image container on first use; later calls are a no-op."""
+    global _containers_initialized
+
+    if _containers_initialized:
+        return
+
+    try:
+        image_container_client.create_container()
+    except ResourceExistsError:
+        pass
+    except Exception as e:
+        # A 403 means SAS credentials that can write blobs but not create
+        # containers, so assume it exists, as before. Anything else may be
+        # transient: still try the upload, and check again next time.
+        if getattr(e, "status_code", None) != 403:
+            print(f"Could not create image container, trying the upload anyway: {e}")
+            return
+    _containers_initialized = True
+
 
 def log_prediction_to_blob(image_url, prediction, score):
-    """Append a log line to a text blob in Azure Blob Storage."""
-    global blob_container_client
+    """Log a prediction to Table Storage if configured, else to the append blob."""
+    if table_client:
+        try:
+            # One entity insert per prediction, partitioned by day
+            table_client.create_entity({
+                "PartitionKey": datetime.now(timezone.utc).date().isoformat(),
+                "RowKey": str(uuid.uuid4()),
+                "ImageUrl": image_url,
+                "Prediction": prediction,
+                "Score": float(score),
+            })
+        except Exception as e:
+            print(f"Error logging to table: {e}")
+        return
 
-    if not blob_container_client:
+    if not log_blob_client:
         return  # logging is optional; don't crash if storage not configured
 
     try:
-        timestamp = datetime.utcnow().isoformat()
-        line = f"{timestamp},{image_url},{prediction},{score}\n"
-        blob_name = "predictions.log"
+        timestamp = datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+        # Format straight to bytes; %a renders the float score like str() does
+        line = b"%b,%b,%b,%a\n" % (
+            timestamp.encode(), image_url.encode("utf-8"), prediction.encode("utf-8"), score
+        )
 
-        # Download existing content (if any)
+        # Atomic server-side append: no download, safe with concurrent writers
+        blob_client = log_blob_client
         try:
-            existing_blob = blob_container_client.download_blob(blob_name).readall().decode("utf-8")
-        except Exception:
-            existing_blob = ""
-
-        new_content = existing_blob + line
-        blob_container_client.upload_blob(
-            name=blob_name,
-            data=new_content,
-            overwrite=True
-        )
+            blob_client.append_block(line)
+        except HttpResponseError as e:
+            if e.error_code != "BlockCountExceedsLimit":
+                raise
+            blob_client = _roll_over_log_blob(blob_client)
+            if blob_client:
+                blob_client.append_block(line)
     except Exception as e:
         print(f"Error logging to blob: {e}")
 
-def upload_image_to_blob_from_url(image_url):
-    if not blob_service_client or not IMAGE_CONTAINER_NAME:
-        return None
 
-    try:
-        container_client = blob_service_client.get_container_client(IMAGE_CONTAINER_NAME)
+def fetch_image(image_url):
+    """Download an image once and return (bytes, content type)."""
+    response = session.get(image_url, timeout=(3.05, 30))
+    response.raise_for_status()
 
-        # Create container if it does not exist
-        try:
-            container_client.create_container()
-        except Exception:
-            pass  # probably already exists
+    # Detect content type (from HTTP header or from file extension)
+    content_type = (
+        response.headers.get("Content-Type")
+        or mimetypes.guess_type(image_url)[0]
+        or "image/jpeg"
+    )
+    return response.content, content_type
 
-        # Get image bytes from the URL
-        response = requests.get(image_url, stream=True)
-        response.raise_for_status()
-        image_bytes = response.content
 
-        # Choose a blob name
-        timestamp = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
-        extension = os.path.splitext(image_url.split("?")[0])[1] or ".jpg"
-        blob_name = f"image_{timestamp}{extension}"
+def upload_image_to_blob_from_url(image_url, image=None):
+    """Upload an image to Blob Storage and return its blob URL.
 
-        blob_client = container_client.get_blob_client(blob_name)
+    `image` is the (bytes, content type) pair already fetched for Computer
+    Vision; it is only downloaded here if the caller doesn't have it.
+    """
+    if not image_container_client:
+        return None
 
-        # Detect content type (from HTTP header or from file extension)
-        content_type = (
-            response.headers.get("Content-Type")
-            or mimetypes.guess_type(image_url)[0]
-            or "image/jpeg"
-        )
+    # Resubmitting the same image doesn't upload it again
+    blob_url = _cache_get(_blob_url_cache, image_url)
+    if blob_url:
+        return blob_url
+
+    try:
+        ensure_image_container()
 
+        image_bytes, content_type = image or fetch_image(image_url)
+
+        # Choose a blob name (nanosecond timestamp, unique per upload)
+        extension = os.path.splitext(image_url.split("?")[0])[1] or ".jpg"
+        blob_name = f"image_{time.time_ns()}{extension}"
+
+        blob_client = image_container_client.get_blob_client(blob_name)
         blob_client.upload_blob(
             image_bytes,
             overwrite=True,
+            max_concurrency=8,
             content_settings=ContentSettings(content_type=content_type),
         )
 
+        _cache_put(_blob_url_cache, image_url, blob_client.url)
         return blob_client.url
 
     except Exception as e:
@@ -196,124 +581,168 @@ def send_prediction_email(to_email, image_url, prediction, score):
     }
 
     try:
+        # ACS queues the message itself; only watch the delivery status in the background
         poller = email_client.begin_send(message)
-        result = poller.result()
-        print(f"Email send status: {result['status']}")
+        executor.submit(poller.result).add_done_callback(_report_email_status)
     except Exception as e:
         print(f"Error sending email: {e}")
 
-def get_predictions_history(limit=50):
-    """Return the last `limit` predictions from the SQL table as a list of dicts."""
-    records = []
 
-    if not SQL_CONNECTION_STRING:
-        print("No SQL connection string configured, cannot load history.")
-        return records
+def _report_email_status(future):
+    """Done-callback that prints the final ACS send status."""
+    exc = future.exception()
+    if exc is not None:
+        print(f"Error sending email: {exc}")
+    else:
+        print(f"Email send status: {future.result()['status']}")
 
-    try:
-        conn = pyodbc.connect(SQL_CONNECTION_STRING)
+# Covering index for the history query, so it never touches the base table:
+#
+#   CREATE INDEX IX_Pred_CreatedAt_Incl ON Predictions (CreatedAt DESC)
+#       INCLUDE (Email, ImageUrl, BlobUrl, Sport, Score);
+HISTORY_FETCH_SIZE = 50
+
+
+def iter_predictions_history(limit=50):
+    """Yield the last `limit` predictions as dicts, fetching rows in small batches."""
+    with get_sql_connection() as conn:
         cursor = conn.cursor()
+        cursor.arraysize = HISTORY_FETCH_SIZE
         cursor.execute(
             """
+            SET NOCOUNT ON;
             SELECT TOP (?) CreatedAt, Email, ImageUrl, BlobUrl, Sport, Score
             FROM Predictions
             ORDER BY CreatedAt DESC
             """,
             (limit,)
         )
-        rows = cursor.fetchall()
-
-        for r in rows:
-            records.append({
-                "created_at": r.CreatedAt,
-                "email": r.Email,
-                "image_url": r.ImageUrl,
-                "blob_url": r.BlobUrl,
-                "sport": r.Sport,
-                "score": float(r.Score),
-            })
+
+        for rows in iter(cursor.fetchmany, []):
+            for r in rows:
+                yield {
+                    "created_at": r.CreatedAt,
+                    "email": r.Email,
+                    "image_url": r.ImageUrl,
+                    "blob_url": r.BlobUrl,
+                    "sport": r.Sport,
+                    "score": float(r.Score),
+                }
 
         cursor.close()
-        conn.close()
+        # End the read transaction so the pooled connection goes back clean
+        conn.commit()
+
+
+def get_predictions_history(limit=50):
+    """Return the last `limit` predictions from the SQL table as a list of dicts."""
+    records = []
+
+    if not SQL_CONNECTION_STRING:
+        print("No SQL connection string configured, cannot load history.")
+        return records
+
+    try:
+        records.extend(iter_predictions_history(limit))
     except Exception as e:
         print("Error loading history from SQL:", e)
 
     return records
 
 
-def predict_sport_from_tags(tags):
-    # Expanded list of sports + keywords that are likely to appear
-    # in Azure Computer Vision tags / descriptions.
-    SPORT_KEYWORDS = {
-        "Football (Soccer)": [
-            "soccer", "football", "soccer ball", "football player",
-            "soccer player", "goalkeeper", "goal post", "football stadium"
-        ],
-        "Basketball": [
-            "basketball", "basketball player", "basketball court",
-            "basketball hoop", "basketball uniform"
-        ],
-        "Tennis": [
-            "tennis", "tennis player", "tennis racket",
-            "tennis court", "tennis ball"
-        ],
-        "Swimming": [
-            "swimming", "swimmer", "swimming pool",
-            "swimwear", "diving platform"
-        ],
-        "Athletics / Running": [
-            "running", "runner", "track", "athletics",
-            "sprinter", "hurdles", "relay race", "marathon"
-        ],
-        "Volleyball": [
-            "volleyball", "volleyball player", "volleyball net",
-            "beach volleyball"
-        ],
-        "Rugby": [
-            "rugby", "rugby ball", "rugby player"
-        ],
-        "Baseball": [
-            "baseball", "baseball bat", "baseball glove",
-            "baseball player", "baseball field"
-        ],
-        "Cricket": [
-            "cricket", "cricket bat", "cricket player",
-            "cricket ball", "wicket"
-        ],
-        "American Football": [
-            "american football", "football helmet",
-            "american football player", "football pads", "nfl"
-        ],
-        "Golf": [
-            "golf", "golf course", "golf club", "golfer",
-        ],
-        "Boxing": [
-            "boxing", "boxer", "boxing ring", "boxing gloves"
-        ],
-        "Martial Arts / MMA": [
-            "martial arts", "karate", "judo", "taekwondo",
-            "mma", "mixed martial arts", "kickboxing"
-        ],
-        "Cycling": [
-            "cycling", "cyclist", "bicycle race",
-            "bike race", "mountain biking", "road cycling"
-        ],
-        "Ski / Snowboard": [
-            "skiing", "skier", "ski slope", "snowboard", "snowboarding"
-        ],
-        "Surfing": [
-            "surfing", "surfer", "surfboard", "wave riding"
-        ],
-        "Gymnastics": [
-            "gymnastics", "gymnast", "balance beam",
-            "uneven bars", "pommel horse", "floor exercise"
-        ],
-        "Ice Hockey": [
-            "ice hockey", "hockey stick", "hockey player",
-            "hockey puck", "ice rink"
-        ],
-    }
+# Expanded list of sports + keywords that are likely to appear
+# in Azure Computer Vision tags / descriptions.
+SPORT_KEYWORDS = {
+    "Football (Soccer)": [
+        "soccer", "football", "soccer ball", "football player",
+        "soccer player", "goalkeeper", "goal post", "football stadium"
+    ],
+    "Basketball": [
+        "basketball", "basketball player", "basketball court",
+        "basketball hoop", "basketball uniform"
+    ],
+    "Tennis": [
+        "tennis", "tennis player", "tennis racket",
+        "tennis court", "tennis ball"
+    ],
+    "Swimming": [
+        "swimming", "swimmer", "swimming pool",
+        "swimwear", "diving platform"
+    ],
+    "Athletics / Running": [
+        "running", "runner", "track", "athletics",
+        "sprinter", "hurdles", "relay race", "marathon"
+    ],
+    "Volleyball": [
+        "volleyball", "volleyball player", "volleyball net",
+        "beach volleyball"
+    ],
+    "Rugby": [
+        "rugby", "rugby ball", "rugby player"
+    ],
+    "Baseball": [
+        "baseball", "baseball bat", "baseball glove",
+        "baseball player", "baseball field"
+    ],
+    "Cricket": [
+        "cricket", "cricket bat", "cricket player",
+        "cricket ball", "wicket"
+    ],
+    "American Football": [
+        "american football", "football helmet",
+        "american football player", "football pads", "nfl"
+    ],
+    "Golf": [
+        "golf", "golf course", "golf club", "golfer",
+    ],
+    "Boxing": [
+        "boxing", "boxer", "boxing ring", "boxing gloves"
+    ],
+    "Martial Arts / MMA": [
+        "martial arts", "karate", "judo", "taekwondo",
+        "mma", "mixed martial arts", "kickboxing"
+    ],
+    "Cycling": [
+        "cycling", "cyclist", "bicycle race",
+        "bike race", "mountain biking", "road cycling"
+    ],
+    "Ski / Snowboard": [
+        "skiing", "skier", "ski slope", "snowboard", "snowboarding"
+    ],
+    "Surfing": [
+        "surfing", "surfer", "surfboard", "wave riding"
+    ],
+    "Gymnastics": [
+        "gymnastics", "gymnast", "balance beam",
+        "uneven bars", "pommel horse", "floor exercise"
+    ],
+    "Ice Hockey": [
+        "ice hockey", "hockey stick", "hockey player",
+        "hockey puck", "ice rink"
+    ],
+}
+
+
+def _build_keyword_index(sport_keywords):
+    """Build an Aho-Corasick automaton mapping each keyword to its sports."""
+    kw_to_sports = {}
+    for sport, keywords in sport_keywords.items():
+        for kw in keywords:
+            kw_to_sports.setdefault(kw, []).append(sport)
+
+    # The automaton reports every keyword occurring in a tag (overlapping ones
+    # included) in a single pass, like the old per-keyword substring test.
+    automaton = ahocorasick.Automaton()
+    for kw, sports in kw_to_sports.items():
+        automaton.add_word(kw, tuple(sports))
+    automaton.make_automaton()
+    return automaton
+
+
+_KW_AUTOMATON = _build_keyword_index(SPORT_KEYWORDS)
+
 
+def predict_sport_from_tags(tags):
     # Initialize scores
     scores = {sport: 0.0 for sport in SPORT_KEYWORDS}
 
@@ -322,17 +751,49 @@ def predict_sport_from_tags(tags):
         name = tag["name"].lower()
         conf = tag.get("confidence", 0.0)
 
-        for sport, keywords in SPORT_KEYWORDS.items():
-            for kw in keywords:
-                # Use substring match so "soccer player" matches "soccer", etc.
-                if kw in name:
-                    scores[sport] = max(scores[sport], conf)
+        # Substring match so "soccer player" matches "soccer", etc.
+        for _, sports in _KW_AUTOMATON.iter(name):
+            for sport in sports:
+                if conf > scores[sport]:
+                    scores[sport] = conf
 
     # Choose the sport with the highest score
     best_sport = max(scores, key=scores.get)
     return best_sport, scores[best_sport], scores
 
 
+def analyze_image(image_bytes):
+    """Run Computer Vision on raw image bytes and return (sport, score, all_scores)."""
+    response = session.post(ANALYZE_URL, headers=_CV_HEADERS, params=_CV_PARAMS, data=image_bytes, timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
+    result = response.json()
+
+    tags = result.get("tags", [])
+    print("Tags from CV:", tags)
+
+    return predict_sport_from_tags(tags)
+
+
+def store_prediction_async(image_url, email, prediction, score, image=None):
+    """Upload, log, save and email a prediction on the background executor."""
+    # 1) Upload the image to Blob and get blob URL
+    upload_future = executor.submit(upload_image_to_blob_from_url, image_url, image)
+    upload_future.add_done_callback(_report_background_error)
+
+    # 2) Log to Blob log file and send the email; neither needs the blob URL
+    executor.submit(log_prediction_to_blob, image_url, prediction, score) \
+        .add_done_callback(_report_background_error)
+    executor.submit(send_prediction_email, email, image_url, prediction, score) \
+        .add_done_callback(_report_background_error)
+
+    # 3) Once the blob URL is known, save to SQL
+    def _after_upload(future):
+        blob_url = None if future.exception() else future.result()
+        executor.submit(save_prediction_to_db, image_url, email, prediction, score, blob_url) \
+            .add_done_callback(_report_background_error)
+
+    upload_future.add_done_callback(_after_upload)
+
 
 @app.route("/", methods=["GET", "POST"])
 def index():
@@ -353,34 +814,19 @@ def index():
         print("Received email:", email)
 
         try:
-            params = {"visualFeatures": "Tags,Description,Objects", "language": "en"}
-            headers = {
-                "Ocp-Apim-Subscription-Key": SUBSCRIPTION_KEY,
-                "Content-Type": "application/json"
-            }
-            data = {"url": image_url}
-
-            response = requests.post(ANALYZE_URL, headers=headers, params=params, json=data)
-            response.raise_for_status()
-            result = response.json()
-
-            tags = result.get("tags", [])
-            print("Tags from CV:", tags)
-
-            prediction, score, all_scores = predict_sport_from_tags(tags)
+            # Download the image once: the bytes go to Computer Vision and to Blob Storage
+            image = None
+            cached = _cache_get(_prediction_cache, image_url)
+            if cached:
+                prediction, score, all_scores = cached
+            else:
+                image = fetch_image(image_url)
+                prediction, score, all_scores = analyze_image(image[0])
+                _cache_put(_prediction_cache, image_url, (prediction, score, all_scores))
             print("Prediction:", prediction, "Score:", score)
 
-            # 1) Upload the image to Blob and get blob URL
-            blob_url = upload_image_to_blob_from_url(image_url)
-
-            # 2) Log to Blob log file
-            log_prediction_to_blob(image_url, prediction, score)
-
-            # 3) Save to SQL with blob URL
-            save_prediction_to_db(image_url, email, prediction, score, blob_url)
-
-
-            send_prediction_email(email, image_url, prediction, score)
+            # Side effects run in the background; the response only needs the prediction
+            store_prediction_async(image_url, email, prediction, score, image)
 
         except Exception as e:
             error = f"Error while calling Computer Vision API or saving to storage: {e}"
@@ -410,5 +856,7 @@ def history():
         history=history,
     )
 
+# Local development only. In production run behind gunicorn (see Dockerfile):
+#   gunicorn -w 4 -k gthread --threads 32 --bind 0.0.0.0:8080 app:app
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8080, debug=True)
+    app.run(host="0.0.0.0", port=8080)
@@ -1 +1 @@
-python -m uvicorn main:app --host 0.0.0.0 
\ No newline at end of file
+gunicorn -w 4 -k gthread --threads 32 --bind 0.0.0.0:8000 app:app